@@ -1,4 +1,5 @@
 from model import LangChangeModel
+from interactions_nb import warm_up
 import argparse
 import agentpy as ap
 import numpy as np
@@ -58,6 +59,9 @@ def run_experiments(mechanism_name: str, min_N: int, max_N: int,
     sims:               Number of simulation runs
     """
 
+    # Compile the interaction kernels once before the parallel runs start
+    warm_up()
+
     common_parameters = {
         'agents': ap.IntRange(min_N, max_N),
         'lingueme': ('A', 'B'),
@@ -0,0 +1,205 @@
+# Compiled interactions of the multi-speaker Moran model
+import numpy as np
+from numba import njit
+
+# Mechanisms of language change
+NEUTRAL_CHANGE = 0
+REPLICATOR_SELECTION = 1
+INTERACTOR_SELECTION = 2
+
+# Number of uniform random numbers consumed by one interaction: choice of
+# the agent and of its neighbour, two tokens, two reinforcements, and a
+# selection draw and a replacement for each of the two listeners
+ROLLS_PER_INTERACTION = 10
+
+
+@njit(cache=True)
+def replace(memory: np.ndarray, n_A: np.ndarray, agent: int, token: int, roll: float) -> int:
+    """
+    Replace a token at a random index of the memory of an agent with the given
+    token and keep the number of tokens of A of the agent in sync. Return the
+    change in the number of tokens of A
+
+    Parameters:
+    -----------
+    memory:        Memories of all agents, one row per agent (1 for A, 0 for B)
+    n_A:           Number of tokens of A in the memory of each agent
+    agent:         Row of the agent
+    token:         Token to be stored: 1 for A, 0 for B
+    roll:          Uniform random number in [0, 1) choosing the index
+    """
+
+    random_index = int(roll * memory.shape[1])
+    change = token - int(memory[agent, random_index])
+    n_A[agent] += change
+    memory[agent, random_index] = token
+    return change
+
+
+@njit(inline='always')
+def listen(memory: np.ndarray, n_A: np.ndarray, listener: int, own_token: int,
+           speaker: int, token: int, mechanism: int, selection_pressure: float,
+           leaders: int, selection_roll: float, index_roll: float) -> int:
+    """
+    Let the listener match more closely the behaviour of the speaker by replacing
+    a randomly removed token in its memory with the token sampled by the speaker,
+    according to one of the three mechanisms of language change: 1. neutral change;
+    2. interactor selection, or 3. replicator selection. Return the change in the
+    number of tokens of A
+
+    Parameters:
+    -----------
+    memory:                 Memories of all agents, one row per agent
+    n_A:                    Number of tokens of A in the memory of each agent
+    listener:               Row of the listening agent
+    own_token:              Token sampled by the listener
+    speaker:                Row of the speaking neighbour
+    token:                  Token sampled by the speaker
+    mechanism:              Mechanism operating: NEUTRAL_CHANGE, REPLICATOR_SELECTION
+                            or INTERACTOR_SELECTION
+    selection_pressure:     Selection pressure/strength
+    leaders:                Number of leaders: the agents in the first rows act as
+                            leaders, independently of the agents that start with A
+    selection_roll:         Uniform random number in [0, 1) tested against the selection pressure
+    index_roll:             Uniform random number in [0, 1) choosing the replaced index
+    """
+
+    change = 0
+
+    # Neutral mechanism
+    if mechanism == NEUTRAL_CHANGE:
+        change = replace(memory, n_A, listener, token, index_roll)
+
+    # Interactor selection: the predicate is evaluated without short-circuit
+    # branches on the random agents and tokens
+    elif mechanism == INTERACTOR_SELECTION:
+        accept = (listener >= leaders) & (speaker < leaders) & (selection_roll < selection_pressure)
+        if accept:
+            change = replace(memory, n_A, listener, token, index_roll)
+
+    # Replicator selection
+    else:
+        accept = (own_token == 0) & (token == 1) & (selection_roll < selection_pressure)
+        if accept:
+            change = replace(memory, n_A, listener, token, index_roll)
+
+    return change
+
+
+@njit(inline='always')
+def run_interactions(memory: np.ndarray, n_A: np.ndarray, indptr: np.ndarray,
+                     indices: np.ndarray, mechanism: int, selection_pressure: float,
+                     leaders: int, rolls: np.ndarray, start: int, T: int) -> int:
+    """
+    Run T interactions. In each interaction, one agent is randomly sampled
+    from the network and its interlocutor is randomly sampled from its
+    neighbourhood. Each of the two agents produces a token, reinforces its
+    own behaviour and copies the behaviour of the other one. Return the
+    change in the total number of tokens of A
+
+    This function and listen are inlined into the kernels below, one per
+    mechanism, so that the branches of the other mechanisms are removed at
+    compile time
+
+    Parameters:
+    -----------
+    memory:                 Memories of all agents, one row per agent (1 for A, 0 for B)
+    n_A:                    Number of tokens of A in the memory of each agent
+    indptr:                 CSR index pointer: the neighbours of agent i are
+                            indices[indptr[i]:indptr[i + 1]]
+    indices:                CSR neighbour indices
+    mechanism:              Mechanism operating: NEUTRAL_CHANGE, REPLICATOR_SELECTION
+                            or INTERACTOR_SELECTION
+    selection_pressure:     Selection pressure/strength
+    leaders:                Number of leaders: the agents in the first rows act as
+                            leaders, independently of the agents that start with A
+    rolls:                  Pre-drawn uniform random numbers in [0, 1),
+                            one row of ROLLS_PER_INTERACTION per interaction
+    start:                  Row of rolls used by the first interaction
+    T:                      Number of interactions
+    """
+
+    n_agents, memory_size = memory.shape
+    change = 0
+
+    for t in range(start, start + T):
+        roll = rolls[t]
+
+        # Choose a random agent and one random neighbour of it
+        agent = int(roll[0] * n_agents)
+        first = indptr[agent]
+        neighbour = indices[first + int(roll[1] * (indptr[agent + 1] - first))]
+
+        # Produce a token: sampling one token from the memory is a Bernoulli
+        # draw of A with the proportion of A in the memory
+        agent_token = 1 if roll[2] * memory_size < n_A[agent] else 0
+        neighbour_token = 1 if roll[3] * memory_size < n_A[neighbour] else 0
+
+        # Reinforce the own behaviour
+        change += replace(memory, n_A, agent, agent_token, roll[4])
+        change += replace(memory, n_A, neighbour, neighbour_token, roll[5])
+
+        # Listen to each other
+        change += listen(memory, n_A, agent, agent_token, neighbour, neighbour_token,
+                         mechanism, selection_pressure, leaders, roll[6], roll[7])
+        change += listen(memory, n_A, neighbour, neighbour_token, agent, agent_token,
+                         mechanism, selection_pressure, leaders, roll[8], roll[9])
+
+    return change
+
+
+@njit(cache=True)
+def run_neutral_change_nb(memory: np.ndarray, n_A: np.ndarray, indptr: np.ndarray,
+                          indices: np.ndarray, selection_pressure: float, leaders: int,
+                          rolls: np.ndarray, start: int, T: int) -> int:
+    """
+    Run T interactions under neutral change, see run_interactions
+    """
+    return run_interactions(memory, n_A, indptr, indices, NEUTRAL_CHANGE,
+                            selection_pressure, leaders, rolls, start, T)
+
+
+@njit(cache=True)
+def run_replicator_selection_nb(memory: np.ndarray, n_A: np.ndarray, indptr: np.ndarray,
+                                indices: np.ndarray, selection_pressure: float, leaders: int,
+                                rolls: np.ndarray, start: int, T: int) -> int:
+    """
+    Run T interactions under replicator selection, see run_interactions
+    """
+    return run_interactions(memory, n_A, indptr, indices, REPLICATOR_SELECTION,
+                            selection_pressure, leaders, rolls, start, T)
+
+
+@njit(cache=True)
+def run_interactor_selection_nb(memory: np.ndarray, n_A: np.ndarray, indptr: np.ndarray,
+                                indices: np.ndarray, selection_pressure: float, leaders: int,
+                                rolls: np.ndarray, start: int, T: int) -> int:
+    """
+    Run T interactions under interactor selection, see run_interactions
+    """
+    return run_interactions(memory, n_A, indptr, indices, INTERACTOR_SELECTION,
+                            selection_pressure, leaders, rolls, start, T)
+
+
+# Kernel of each mechanism
+KERNELS = {
+    NEUTRAL_CHANGE: run_neutral_change_nb,
+    REPLICATOR_SELECTION: run_replicator_selection_nb,
+    INTERACTOR_SELECTION: run_interactor_selection_nb
+}
+
+
+def warm_up() -> None:
+    """
+    Compile the kernels on a network of two agents. Since the kernels are cached
+    on disk, each worker process of an experiment then loads the compiled
+    machine code instead of compiling the kernels again
+    """
+
+    memory = np.zeros((2, 1), dtype=np.uint8)
+    n_A = np.zeros(2, dtype=np.int64)
+    indptr = np.array([0, 1, 2], dtype=np.int32)
+    indices = np.array([1, 0], dtype=np.int32)
+    rolls = np.zeros((1, ROLLS_PER_INTERACTION))
+    for kernel in KERNELS.values():
+        kernel(memory, n_A, indptr, indices, 0.0, 0, rolls, 0, 1)
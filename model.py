@@ -1,8 +1,9 @@
 # Model design
-import random
 import agentpy as ap
 import numpy as np
 import networkx as nx
+from interactions_nb import (KERNELS, ROLLS_PER_INTERACTION, NEUTRAL_CHANGE,
+                             REPLICATOR_SELECTION, INTERACTOR_SELECTION)
 from utils import batch_simulate
 import argparse
 
@@ -17,86 +18,41 @@ arg_parser.add_argument('--sim_steps', type=int, default=100000, help='Number of
 arg_parser.add_argument('--exp_num', default=5, help='Number of experiments')
 arg_parser.add_argument('--m', default='neutral_change', help='Mechanism name')
 
+# Number of interactions for which random numbers are drawn at once
+ROLLS_BLOCK = 1024
+
 
 class Agent(ap.Agent):
 
     def setup(self) -> None:
         """
         Set up initial states of an agent.
-        """
-
-        # Initial distribution of linguistic variants A and B
-        self.memory = np.random.choice(self.p.lingueme, size=self.p.memory_size, p=[0, 1])
-
-        # Frequency of A
-        self.A = np.count_nonzero(self.memory == 'A') / len(self.memory)
-
-        # The produced token
-        self.sampled_token = None
-
-    def speak(self) -> None:
-        """
-        Produce an utterance by randomly sampling one token from the memory
-        """
-
-        self.sampled_token = np.random.choice(self.memory, size=1)[0]
 
-    def reinforce(self) -> None:
-        """
-        Reinforce the own behaviour replacing a randomly removed token in the memory
-        with the copy of the sampled token
+        The state of all agents is stored in the arrays of the model, one row
+        per agent, so that the interactions can be run by the compiled kernel
+        in interactions_nb.py. The memory stores the variants numerically:
+        1 for the innovative variant A and 0 for the conventional variant B.
         """
 
-        # Choose a random index to remove
-        random_index = np.random.randint(len(self.memory))
-        # Replace with the sampled token
-        self.memory[random_index] = self.sampled_token
+        # Row of the agent in the state arrays of the model
+        self.index = None
 
-    def listen(self, neighbour) -> None:
+    @property
+    def memory(self) -> np.ndarray:
         """
-        Listen to the neighbour to match more closely his behaviour by replacing
-        the randomly removed token in the memory with the token sampled by the neighbour
-
-        The process of listening is preformed according to the three mechanisms
-        of language change: 1. neutral change; 2. interactor selection, and
-        3. replicator selection
-
-        Parameters:
-        -----------
-        neighbour:     One of the k neighbours of an agent
+        Memory of the agent, read-only: the memory is only changed by the kernel,
+        which keeps the numbers of tokens of A in sync
         """
+        memory = self.model.memory[self.index]
+        memory.setflags(write=False)
+        return memory
 
-        # Neutral mechanism
-        if self.p.neutral_change:
-            # Choose a random index to remove
-            random_index = np.random.randint(len(self.memory))
-            # Replace with the token sampled by the neighbour
-            self.memory[random_index] = neighbour.sampled_token
-
-        # Interactor selection
-        if self.p.interactor_selection:
-            if self.id > self.p.leaders:
-                if neighbour.id <= self.p.leaders:
-                    if random.random() < self.p.selection_pressure:
-                        # Choose a random index to remove
-                        random_index = np.random.randint(len(self.memory))
-                        # Replace with the token sampled by the neighbour
-                        self.memory[random_index] = neighbour.sampled_token
-
-        # Replicator selection
-        if self.p.replicator_selection:
-            if self.sampled_token == 'B' and neighbour.sampled_token == 'A':
-                if random.random() < self.p.selection_pressure:
-                    # Choose a random index to remove
-                    random_index = np.random.randint(len(self.memory))
-                    # Replace with the token sampled by the neighbour
-                    self.memory[random_index] = neighbour.sampled_token
-
-    def update(self) -> None:
+    @property
+    def A(self) -> float:
         """
-        Record the proportion of the innovative variant A based on the updated memory
+        Proportion of the innovative variant A in the memory of the agent
         """
-        self.A = np.count_nonzero(self.memory == 'A') / len(self.memory)
+        return self.model.n_A[self.index] / self.model._msize
 
 
 class LangChangeModel(ap.Model):
@@ -106,17 +62,41 @@ class LangChangeModel(ap.Model):
         Initialize a population of agents and the network type in which they exist and interact
         """
 
+        # The mechanisms of language change are mutually exclusive
+        mechanisms = (self.p.neutral_change, self.p.replicator_selection, self.p.interactor_selection)
+        if sum(bool(flag) for flag in mechanisms) > 1:
+            raise ValueError('At most one of neutral_change, replicator_selection and '
+                             'interactor_selection can be set')
+
         # Initialize a graph
         graph = nx.watts_strogatz_graph(
             self.p.agents,
             self.p.number_of_neighbors,
-            self.p.rewiring_probability
+            self.p.rewiring_probability,
+            seed=self.random
         )
 
-        # Create agents and network
+        # Initial distribution of linguistic variants A and B: one memory row per agent
+        self.memory = np.zeros((self.p.agents, self.p.memory_size), dtype=np.uint8)
+        # Number of tokens of A in the memory of each agent
+        self.n_A = np.zeros(self.p.agents, dtype=np.int64)
+
+        # Encode the network as CSR arrays: the neighbours of agent i
+        # are indices[indptr[i]:indptr[i + 1]]
+        adjacency = nx.to_scipy_sparse_array(graph, nodelist=range(self.p.agents), format='csr')
+        self.indptr = adjacency.indptr
+        self.indices = adjacency.indices
+
+        # Every agent needs a neighbour to interact with: the kernel does not
+        # check this and would read past the neighbour indices otherwise
+        if np.any(np.diff(self.indptr) == 0):
+            raise ValueError('Every agent must have at least one neighbour, '
+                             f'got number_of_neighbors={self.p.number_of_neighbors}')
+
+        # Create agents
         self.agents = ap.AgentList(self, self.p.agents, Agent)
-        self.network = self.agents.network = ap.Network(self, graph)
-        self.network.add_agents(self.agents, self.network.nodes)
+        for index, agent in enumerate(self.agents):
+            agent.index = index
 
         # Change setup of agents according to the mechanism operating
 
@@ -125,30 +105,56 @@ class LangChangeModel(ap.Model):
             # Compute the number of agents who use an innovation
             num_innovation_agents = int(self.p.initial_frequency * self.p.agents)
             # Randomly choose the defined number of agents from the population
-            innovation_agents = self.random.sample(self.agents, num_innovation_agents)
-            # Update the memory and the usage frequency of each agent from the subset
-            for agent in innovation_agents:
-                agent.memory = np.random.choice(self.p.lingueme, size=self.p.memory_size, p=[1, 0])
-                agent.A = np.count_nonzero(agent.memory == 'A') / len(agent.memory)
+            innovation_agents = self.nprandom.choice(self.p.agents, num_innovation_agents, replace=False)
+            # Update the memory and the usage frequency of all agents from the subset at once
+            self.memory[innovation_agents] = 1
+            self.n_A[innovation_agents] = self.p.memory_size
 
         # Mechanism: Interactor selection
         # Compute the number of leaders
         if self.p.interactor_selection:
             self.p.leaders = int(self.p.agents * self.p.n)
-            # Randomly choose the defined number of leaders from the population
-            leaders = self.random.sample(self.agents, self.p.leaders)
-            # Update the memory and the usage frequency of each agent from the subset
-            for agent in leaders:
-                agent.memory = np.random.choice(self.p.lingueme, size=self.p.memory_size, p=[1, 0])
-                agent.A = np.count_nonzero(agent.memory == 'A') / len(agent.memory)
+            # Randomly choose the defined number of leaders from the population.
+            # Note that during the interactions, the agents in the first
+            # self.p.leaders rows (ids 1 to leaders) act as leaders, not the agents
+            # chosen here. This mismatch is kept from the model used for the
+            # thesis so that the results stay comparable with sim_data
+            leaders = self.nprandom.choice(self.p.agents, self.p.leaders, replace=False)
+            # Update the memory and the usage frequency of all agents from the subset at once
+            self.memory[leaders] = 1
+            self.n_A[leaders] = self.p.memory_size
+
+        # Mechanism operating, neutral change by default
+        if self.p.interactor_selection:
+            mechanism = INTERACTOR_SELECTION
+        elif self.p.replicator_selection:
+            mechanism = REPLICATOR_SELECTION
+        else:
+            mechanism = NEUTRAL_CHANGE
+
+        # Kernel compiled for the mechanism and parameters of the interactions,
+        # cached as plain scalars to avoid the parameter lookups on every step
+        self._kernel = KERNELS[mechanism]
+        self._msize = self.p.memory_size
+        self._selection_pressure = float(self.p.get('selection_pressure', 0.0))
+        self._leaders = int(self.p.get('leaders') or 0)
+
+        # Uniform random numbers of the interactions, drawn in blocks from
+        # the seeded generator of the model
+        self._rolls = self.nprandom.random((ROLLS_BLOCK, ROLLS_PER_INTERACTION))
+        self._roll = 0
+
+        # Total number of tokens of A, kept in sync with the changes made by the
+        # kernel so that the average probability of A needs no reduction per step
+        self._total_A = int(self.n_A.sum())
+        self._total_size = self.p.agents * self._msize
 
     def update(self) -> None:
         """
         Record the average probability of the innovative variant A after setup and each step
         """
 
-        average_A = sum(self.agents.A) / len(self.agents.A)
-        self.record('A', average_A)
+        self.record('A', self._total_A / self._total_size)
 
     def step(self) -> None:
         """
@@ -160,35 +166,25 @@ class LangChangeModel(ap.Model):
         a linguistic variant A or B, reinforces its own behaviour,
         copies the behaviour of the neighbour, and updates its
         probability of using the innovative variant A based on its
-        updated memory
+        updated memory. The interaction is run by the compiled kernel
+        on the state arrays of the model
         """
 
-        # Choose a random agent from agents
-        agent = self.random.choice(self.agents)
-        # Initialize neighbors
-        neighbors = [j for j in self.network.neighbors(agent)]
-        # Select one random neighbor
-        neighbor = self.random.choice(neighbors)
-
-        # Perform actions during the interaction
-        agent.speak()
-        neighbor.speak()
-
-        agent.reinforce()
-        neighbor.reinforce()
-
-        agent.listen(neighbor)
-        neighbor.listen(agent)
+        if self._roll == ROLLS_BLOCK:
+            self.nprandom.random(out=self._rolls)
+            self._roll = 0
 
-        agent.update()
-        neighbor.update()
+        self._total_A += self._kernel(self.memory, self.n_A, self.indptr, self.indices,
+                                      self._selection_pressure, self._leaders,
+                                      self._rolls, self._roll, 1)
+        self._roll += 1
 
     def end(self) -> None:
         """
         Report final average probability of A at the end of the simulation.
         """
 
-        final_average_A = sum(self.agents.A) / len(self.agents.A)
+        final_average_A = self._total_A / self._total_size
         self.report('final_A', final_average_A)
 
 